@@ -4,19 +4,90 @@ Database operations for the Knowledge Base MCP Server.
 Handles SQLite database initialization, indexing, and queries.
 """
 
+import atexit
+import hashlib
+import json
 import sqlite3
 import sys
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any
 import re
 
 
+def _connect(db_path: str) -> sqlite3.Connection:
+    """Open a SQLite connection tuned for this workload.
+
+    WAL mode lets searches run while the indexer writes, and
+    synchronous=NORMAL drops one fsync per commit (safe in WAL mode).
+    The connection is opened in autocommit mode; bulk paths manage
+    their own BEGIN/COMMIT explicitly.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None, cached_statements=256)
+    # One executescript round instead of seven statement preparations.
+    # foreign_keys backs the ON DELETE CASCADE on note_summaries;
+    # recursive_triggers makes INSERT OR REPLACE fire the FTS delete
+    # trigger for the row it implicitly removes.
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-65536;
+        PRAGMA busy_timeout=5000;
+        PRAGMA foreign_keys=ON;
+        PRAGMA recursive_triggers=ON;
+    """)
+    return conn
+
+
+# One connection per (thread, db_path), opened lazily. Reusing connections
+# keeps the page cache warm across queries and skips the per-call open cost;
+# SQLite connections must not cross threads, hence the thread-local.
+_local = threading.local()
+
+
+def _get_conn(db_path: str) -> sqlite3.Connection:
+    """Return this thread's cached connection for db_path."""
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = _connect(db_path)
+    return conn
+
+
+def close_connections():
+    """Close the calling thread's pooled connections.
+
+    Registered atexit for the main thread; worker threads that want a
+    clean shutdown can call it themselves. PRAGMA optimize on close is
+    the cheap point to persist gathered query statistics.
+    """
+    conns = getattr(_local, 'conns', None)
+    if not conns:
+        return
+    for conn in conns.values():
+        try:
+            conn.execute("PRAGMA optimize")
+            conn.close()
+        except sqlite3.Error:
+            pass
+    conns.clear()
+
+
+atexit.register(close_connections)
+
+
 def init_db(db_path: str):
     """Initialize the SQLite database for storing indexed notes."""
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -28,25 +99,191 @@ def init_db(db_path: str):
                        title TEXT,
                        content TEXT NOT NULL,
                        tags TEXT,
-                       created_at TEXT,
-                       modified_at TEXT,
-                       indexed_at TEXT NOT NULL
+                       created_at INTEGER,
+                       modified_at INTEGER,
+                       indexed_at INTEGER NOT NULL,
+                       size INTEGER,
+                       content_hash TEXT
                    )
                    """)
 
-    # Create a full-text search virtual table
+    # Let get_recent_notes serve ORDER BY modified_at DESC LIMIT n straight
+    # from an index instead of sorting the whole table
     cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notes_modified_at
+        ON notes(modified_at DESC)
+    """)
+
+    # Create a full-text search virtual table. filepath is retrievable but
+    # not tokenized (paths bloat the index and nobody full-text searches
+    # them); porter stemming improves recall on word searches. The prefix
+    # indexes serve 2- and 3-character prefix queries without scanning the
+    # full doclist per term.
+    fts_ddl = """
         CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
-            filepath,
+            filepath UNINDEXED,
             filename,
             title,
             content,
             tags,
             content='notes',
-            content_rowid='id'
+            content_rowid='id',
+            prefix='2 3',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )
+    """
+
+    # Schema version 1 introduced the UNINDEXED column and tokenizer change;
+    # older databases carry an FTS table built with the defaults, so drop it
+    # and rebuild from the notes content table.
+    schema_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if schema_version < 1:
+        cursor.execute("DROP TABLE IF EXISTS notes_fts")
+    cursor.execute(fts_ddl)
+    if schema_version < 1:
+        cursor.execute("INSERT INTO notes_fts(notes_fts) VALUES('rebuild')")
+
+    # Schema version 2 added size and content_hash for change detection
+    # during reindex; tables created before then gain the columns in place
+    if schema_version < 2:
+        existing = {row[1] for row in cursor.execute("PRAGMA table_info(notes)")}
+        if 'size' not in existing:
+            cursor.execute("ALTER TABLE notes ADD COLUMN size INTEGER")
+        if 'content_hash' not in existing:
+            cursor.execute("ALTER TABLE notes ADD COLUMN content_hash TEXT")
+        # Update triggers became column-scoped in v2 so stat-only touches
+        # do not rewrite the FTS index; drop the old forms for re-creation
+        cursor.execute("DROP TRIGGER IF EXISTS notes_au")
+        cursor.execute("DROP TRIGGER IF EXISTS notes_meta_au")
+
+    # Schema version 6 rebuilt notes with INTEGER timestamp columns.
+    # Baseline databases declared created_at/modified_at/indexed_at TEXT,
+    # and column affinity coerced every epoch-nanosecond write to a digit
+    # string: ts_to_iso echoed the raw digits and the mtime skip check in
+    # index_directory (str against int) never matched, so incremental
+    # reindex silently re-read every note on upgraded deployments. Copy
+    # the rows into a correctly-typed table, casting digit strings back
+    # to integers; ISO strings from before the integer change stay as-is
+    # and the next reindex rewrites those rows once.
+    if schema_version < 6:
+        col_type = cursor.execute(
+            "SELECT type FROM pragma_table_info('notes') WHERE name = 'modified_at'"
+        ).fetchone()
+        if col_type and col_type[0].upper() != 'INTEGER':
+            # With foreign keys on, DROP TABLE runs an implicit DELETE that
+            # would cascade into note_summaries; ids are preserved, so the
+            # summaries (and the FTS index) stay valid across the swap. The
+            # pragma is a no-op inside a transaction, so toggle it first —
+            # the connection is autocommit here — then run the whole swap
+            # in one transaction: a crash mid-swap rolls everything back
+            # and the migration simply re-runs on the next start.
+            cursor.execute("PRAGMA foreign_keys=OFF")
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                CREATE TABLE notes_fixed (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filepath TEXT UNIQUE NOT NULL,
+                    filename TEXT NOT NULL,
+                    title TEXT,
+                    content TEXT NOT NULL,
+                    tags TEXT,
+                    created_at INTEGER,
+                    modified_at INTEGER,
+                    indexed_at INTEGER NOT NULL,
+                    size INTEGER,
+                    content_hash TEXT
+                )
+            """)
+            int_cast = ("CASE WHEN typeof({c}) = 'text' AND {c} != '' "
+                        "AND {c} NOT GLOB '*[^0-9]*' "
+                        "THEN CAST({c} AS INTEGER) ELSE {c} END")
+            cursor.execute("""
+                INSERT INTO notes_fixed (id, filepath, filename, title, content,
+                                         tags, created_at, modified_at,
+                                         indexed_at, size, content_hash)
+                SELECT id, filepath, filename, title, content, tags,
+                       {created}, {modified}, {indexed}, size, content_hash
+                FROM notes
+            """.format(created=int_cast.format(c='created_at'),
+                       modified=int_cast.format(c='modified_at'),
+                       indexed=int_cast.format(c='indexed_at')))
+            # Dropping notes takes its triggers and the modified_at index
+            # with it; the IF NOT EXISTS statements below recreate them.
+            cursor.execute("DROP TABLE notes")
+            cursor.execute("ALTER TABLE notes_fixed RENAME TO notes")
+            cursor.execute("""
+                CREATE INDEX idx_notes_modified_at ON notes(modified_at DESC)
+            """)
+            cursor.execute("COMMIT")
+            cursor.execute("PRAGMA foreign_keys=ON")
+
+    # Keep the external-content FTS index in sync from triggers so writers
+    # only ever touch the notes table
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts(rowid, filepath, filename, title, content, tags)
+            VALUES (new.id, new.filepath, new.filename, new.title, new.content, new.tags);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, filepath, filename, title, content, tags)
+            VALUES ('delete', old.id, old.filepath, old.filename, old.title, old.content, old.tags);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS notes_au
+        AFTER UPDATE OF filepath, filename, title, content, tags ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, filepath, filename, title, content, tags)
+            VALUES ('delete', old.id, old.filepath, old.filename, old.title, old.content, old.tags);
+            INSERT INTO notes_fts(rowid, filepath, filename, title, content, tags)
+            VALUES (new.id, new.filepath, new.filename, new.title, new.content, new.tags);
+        END
+    """)
+
+    # Single-row summary table so get_kb_statistics never has to scan every
+    # note body for SUM(LENGTH(content)); seeded from the current contents
+    # and kept current by the notes_meta_* triggers below
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS kb_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_notes INTEGER NOT NULL DEFAULT 0,
+            total_chars INTEGER NOT NULL DEFAULT 0,
+            last_indexed INTEGER
         )
     """)
 
+    # Schema version 4 moved the last-indexed timestamp into kb_meta so
+    # statistics no longer aggregate over the notes table
+    if schema_version < 4:
+        existing = {row[1] for row in cursor.execute("PRAGMA table_info(kb_meta)")}
+        if 'last_indexed' not in existing:
+            cursor.execute("ALTER TABLE kb_meta ADD COLUMN last_indexed INTEGER")
+            cursor.execute("""
+                UPDATE kb_meta SET last_indexed = (SELECT MAX(indexed_at) FROM notes)
+            """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO kb_meta (id, total_notes, total_chars)
+        SELECT 1, COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM notes
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS notes_meta_ai AFTER INSERT ON notes BEGIN
+            UPDATE kb_meta SET total_notes = total_notes + 1,
+                               total_chars = total_chars + LENGTH(new.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS notes_meta_ad AFTER DELETE ON notes BEGIN
+            UPDATE kb_meta SET total_notes = total_notes - 1,
+                               total_chars = total_chars - LENGTH(old.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS notes_meta_au AFTER UPDATE OF content ON notes BEGIN
+            UPDATE kb_meta SET total_chars = total_chars + LENGTH(new.content) - LENGTH(old.content);
+        END
+    """)
+
     # Create table for tool prompts and instructions (for small LLMs)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS tool_prompts (
@@ -65,10 +302,28 @@ def init_db(db_path: str):
             summary TEXT NOT NULL,
             key_topics TEXT,
             last_updated TEXT NOT NULL,
+            content_hash TEXT,
             FOREIGN KEY(filepath) REFERENCES notes(filepath) ON DELETE CASCADE
         )
     """)
 
+    # Schema version 3 added content_hash to note_summaries so summaries
+    # are only rewritten when the note body actually changed
+    if schema_version < 3:
+        existing = {row[1] for row in cursor.execute("PRAGMA table_info(note_summaries)")}
+        if 'content_hash' not in existing:
+            cursor.execute("ALTER TABLE note_summaries ADD COLUMN content_hash TEXT")
+
+    # Schema version 5 added the FTS prefix indexes, which change the
+    # on-disk shape of the index, so existing tables are dropped and
+    # rebuilt from notes. Version 0 databases already got the new DDL
+    # from the rebuild above.
+    if 0 < schema_version < 5:
+        cursor.execute("DROP TABLE IF EXISTS notes_fts")
+        cursor.execute(fts_ddl)
+        cursor.execute("INSERT INTO notes_fts(notes_fts) VALUES('rebuild')")
+    cursor.execute("PRAGMA user_version = 6")
+
     # Create table for query cache
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS query_cache (
@@ -82,74 +337,217 @@ def init_db(db_path: str):
     """)
 
     conn.commit()
-    conn.close()
+
+
+# Frontmatter block and key/value line patterns, compiled once so bulk
+# indexing pays no per-file Python loop over frontmatter lines
+# \r?\n on the fences keeps CRLF (Windows-authored) notes parsing; the
+# strip() on keys and values below swallows any \r left inside the block.
+# Both fences must sit alone on their line (the closing one may end the
+# file), so a ---- horizontal rule is never mistaken for a fence
+_FM_SPLIT_RE = re.compile(r'\A---[ \t]*\r?\n(.*?)\r?\n---[ \t]*\r?(?:\n(.*))?\Z', re.DOTALL)
+_FM_LINE_RE = re.compile(r'^([^:\n]+):(.*)$', re.MULTILINE)
+
+# First markdown H1 heading, used as the note title fallback
+_TITLE_RE = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+
+# Filename slug sanitizers for create_note_file
+_SLUG_STRIP_RE = re.compile(r'[^\w\s-]')
+_SLUG_DASH_RE = re.compile(r'[-\s]+')
+# Deletion table mapping every ASCII codepoint outside [a-z0-9-_ \s] to
+# None, so the ASCII fast path is a single C-level str.translate call
+_SLUG_DELETE_TABLE = str.maketrans('', '', ''.join(
+    chr(i) for i in range(128)
+    if chr(i) not in 'abcdefghijklmnopqrstuvwxyz0123456789-_ \t\n\r\f\v'
+))
+
+
+def _sanitize_slug(part: str) -> str:
+    """Lowercase a title component and reduce it to a filename slug.
+
+    ASCII titles (the common case) are cleaned with one str.translate
+    pass instead of the regex state machine; non-ASCII titles fall back
+    to the regex so unicode word characters are preserved as before.
+    """
+    lowered = part.lower()
+    if lowered.isascii():
+        lowered = lowered.translate(_SLUG_DELETE_TABLE)
+    else:
+        lowered = _SLUG_STRIP_RE.sub('', lowered)
+    return _SLUG_DASH_RE.sub('-', lowered).strip('-')
+
+# Shared between index_directory and upsert_note_to_db so both hit the same
+# entry in the connection's statement cache. An UPSERT updates conflicting
+# rows in place — unlike INSERT OR REPLACE it keeps the row id stable and
+# fires the UPDATE trigger for incremental FTS maintenance instead of a
+# delete/reinsert pair.
+_UPSERT_NOTE_SQL = """
+    INSERT INTO notes
+    (filepath, filename, title, content, tags, created_at, modified_at, indexed_at, size, content_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(filepath) DO UPDATE SET
+        filename=excluded.filename,
+        title=excluded.title,
+        content=excluded.content,
+        tags=excluded.tags,
+        created_at=excluded.created_at,
+        modified_at=excluded.modified_at,
+        indexed_at=excluded.indexed_at,
+        size=excluded.size,
+        content_hash=excluded.content_hash
+"""
+
+
+def ts_to_iso(ts) -> str:
+    """Convert a stored epoch-nanosecond timestamp to an ISO string.
+
+    Timestamps are kept as integers in the database (cheap to store and
+    compare); this is the one place they get formatted for display.
+    Rows written before the integer migration held ISO strings already.
+    """
+    if ts is None:
+        return ''
+    if isinstance(ts, str):
+        return ts
+    return datetime.fromtimestamp(ts / 1_000_000_000).isoformat()
 
 
 def extract_frontmatter(content: str) -> tuple:
     """Extract YAML frontmatter from the Markdown content."""
-    frontmatter = {}
+    # Most notes have no frontmatter; a startswith check is far cheaper
+    # than entering the regex engine just to fail the match
+    if not content.startswith("---"):
+        return {}, content
+
+    match = _FM_SPLIT_RE.match(content)
+    if not match:
+        return {}, content
+
+    frontmatter = {
+        key.strip(): value.strip().strip('"').strip("'")
+        for key, value in _FM_LINE_RE.findall(match.group(1))
+    }
+
+    return frontmatter, (match.group(2) or '').strip()
+
+
+def _iter_md_files(directory: str):
+    """Yield (path, stat_result) for every Markdown file under directory.
+
+    os.scandir hands back stat information cached from the directory read,
+    so this avoids the extra stat syscall per file that Path.rglob +
+    Path.stat would pay.
+    """
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _iter_md_files(entry.path)
+                elif entry.name.endswith('.md') and entry.is_file():
+                    yield entry.path, entry.stat()
+            except OSError as e:
+                print(f"Error scanning {entry.path}: {e}", file=sys.stderr)
+
 
-    if content.startswith("---"):
-        parts = content.split("---", 2)
-        if len(parts) >= 3:
-            fm_text = parts[1]
-            content = parts[2].strip()
+# Notes larger than this are indexed truncated: a markdown note this size
+# is almost certainly an accidental paste, and FTS-indexing it whole would
+# bloat the index and stall the reindex batch
+_MAX_NOTE_BYTES = 1024 * 1024
 
-            for line in fm_text.strip().split("\n"):
-                if ":" in line:
-                    key, value = line.split(":", 1)
-                    key = key.strip()
-                    value = value.strip().strip('"').strip("'")
-                    frontmatter[key] = value
 
-    return frontmatter, content
+def index_file(filepath: Path, stat=None, indexed_at=None) -> Dict[str, Any]:
+    """Index a single Markdown file.
 
+    A stat result from the directory walk can be passed in to avoid
+    re-statting the file, and bulk callers can pass a shared indexed_at
+    timestamp so it is not re-read per file.
+    """
+    if stat is None:
+        stat = filepath.stat()
+
+    # Read raw bytes and decode once: skips the TextIOWrapper's incremental
+    # decoder and line-ending state machine, which matter at bulk-reindex scale
+    if stat.st_size > _MAX_NOTE_BYTES:
+        print(f"Warning: {filepath} is {stat.st_size} bytes; indexing first "
+              f"{_MAX_NOTE_BYTES} only", file=sys.stderr)
+        with open(filepath, 'rb') as f:
+            raw = f.read(_MAX_NOTE_BYTES)
+        # The cut can land mid-codepoint; drop the partial character
+        content = raw.decode('utf-8', errors='ignore')
+    else:
+        raw = filepath.read_bytes()
+        content = raw.decode('utf-8')
 
-def index_file(filepath: Path) -> Dict[str, Any]:
-    """Index a single Markdown file."""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
+    return _note_data_from_content(filepath, raw, content, stat, indexed_at)
+
+
+def index_file_from_text(filepath: Path, content: str, stat=None,
+                         indexed_at=None) -> Dict[str, Any]:
+    """Index a note whose content is already in memory.
+
+    Used by the write paths right after they put content on disk, so the
+    file is not read back just to index what was written.
+    """
+    if stat is None:
+        stat = filepath.stat()
+    return _note_data_from_content(filepath, content.encode('utf-8'), content,
+                                   stat, indexed_at)
 
+
+def _note_data_from_content(filepath: Path, raw: bytes, content: str,
+                            stat, indexed_at) -> Dict[str, Any]:
     frontmatter, body = extract_frontmatter(content)
 
     # Extract title
     title = frontmatter.get('title', '')
     if not title:
-        match = re.search(r'^#\s+(.+)$', body, re.MULTILINE)
-        if match:
-            title = match.group(1)
+        if body.startswith('# '):
+            # Nearly every note opens with its H1; slicing the first line
+            # beats running the multiline regex from the top of the body
+            newline = body.find('\n', 2)
+            title = (body[2:] if newline == -1 else body[2:newline]).strip()
         else:
-            title = filepath.stem
+            match = _TITLE_RE.search(body)
+            if match:
+                title = match.group(1)
+            else:
+                title = filepath.stem
 
     # Get tags
     tags = frontmatter.get('tags', '')
     if isinstance(tags, list):
         tags = ', '.join(tags)
 
-    # Get file timestamps
-    stat = filepath.stat()
-    created_at = datetime.fromtimestamp(stat.st_ctime).isoformat()
-    modified_at = datetime.fromtimestamp(stat.st_mtime).isoformat()
-
+    # File timestamps are stored as epoch nanoseconds (see ts_to_iso)
     return {
         'filepath': str(filepath),
         'filename': filepath.name,
         'title': title,
         'content': body,
         'tags': tags,
-        'created_at': created_at,
-        'modified_at': modified_at,
-        'indexed_at': datetime.now().isoformat()
+        'created_at': stat.st_ctime_ns,
+        'modified_at': stat.st_mtime_ns,
+        'indexed_at': indexed_at if indexed_at is not None else time.time_ns(),
+        'size': stat.st_size,
+        'content_hash': hashlib.sha256(raw).hexdigest()
     }
 
 
-def index_directory(directory: str, db_path: str) -> tuple[int, int]:
+def index_directory(directory: str, db_path: str, full: bool = False) -> tuple[int, int]:
     """Index all Markdown files in the directory and remove orphaned entries.
 
+    With full=True every file is re-read regardless of the change
+    detection and the FTS index is rebuilt from scratch afterwards —
+    the recovery path for a corrupted or out-of-sync search index.
+
     Returns:
         tuple: (indexed_count, removed_count)
     """
-    conn = sqlite3.connect(db_path)
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
     kb_path = Path(directory)
@@ -158,93 +556,229 @@ def index_directory(directory: str, db_path: str) -> tuple[int, int]:
         kb_path.mkdir(parents=True, exist_ok=True)
         return 0, 0
 
-    # Step 1: Get all files currently on filesystem
-    filesystem_files = set()
-    for md_file in kb_path.rglob("*.md"):
-        filesystem_files.add(str(md_file))
+    # Step 1: Get all files currently on filesystem (with their stat results)
+    fs_stats = dict(_iter_md_files(directory))
+    filesystem_files = set(fs_stats)
 
-    # Step 2: Get all files currently in database
-    cursor.execute("SELECT filepath FROM notes")
-    db_files = {row[0] for row in cursor.fetchall()}
+    # Step 2: Get all files currently in database with their stored
+    # change-detection fields
+    cursor.execute("SELECT filepath, modified_at, size, content_hash FROM notes")
+    db_state = {row[0]: row[1:] for row in cursor.fetchall()}
 
     # Step 3: Find orphaned entries (in DB but not on filesystem)
-    orphaned_files = db_files - filesystem_files
-
-    # Step 4: Remove orphaned entries from both tables
-    removed_count = 0
-    for filepath in orphaned_files:
-        # Delete from FTS table first (foreign key constraint)
-        cursor.execute("DELETE FROM notes_fts WHERE rowid IN (SELECT id FROM notes WHERE filepath = ?)", (filepath,))
-        # Delete from notes table
-        cursor.execute("DELETE FROM notes WHERE filepath = ?", (filepath,))
-        removed_count += 1
-        print(f"Removed orphaned entry: {filepath}", file=sys.stderr)
-
-    # Step 5: Index/update all current files
-    indexed_count = 0
-    for md_file_path in filesystem_files:
-        try:
-            md_file = Path(md_file_path)
-            note_data = index_file(md_file)
+    orphaned_files = set(db_state) - filesystem_files
+
+    # Files whose mtime and size both match the stored values have not
+    # changed since the last run and are skipped with no read or parse.
+    # mtime-only mismatches (touch, git checkout) get a content-hash
+    # tie-break below so they do not churn the FTS index.
+    if full:
+        changed_files = list(filesystem_files)
+    else:
+        changed_files = []
+        for p in filesystem_files:
+            stored = db_state.get(p)
+            st = fs_stats[p]
+            if stored is None or stored[0] != st.st_mtime_ns or stored[1] != st.st_size:
+                changed_files.append(p)
+
+    # Step 4: Parse all current files, then write them in a single transaction.
+    # Parsing (file reads + regex) is fanned out across a thread pool since it
+    # is I/O-bound and index_file is pure; the SQLite writes stay on this
+    # thread. Batching the INSERTs avoids one implicit commit (and fsync) per
+    # file and lets SQLite reuse the prepared statements across the batch.
+    note_rows = []
+    touch_rows = []
+    summary_rows = []
+    # One timestamp for the whole batch: per-file clock reads add nothing
+    batch_indexed_at = time.time_ns()
+
+    # KB_INDEX_THREADS overrides the worker count for unusual storage
+    # (high-latency NFS wants more, a saturated spinning disk fewer)
+    try:
+        max_workers = int(os.environ['KB_INDEX_THREADS'])
+    except (KeyError, ValueError):
+        max_workers = min(32, (os.cpu_count() or 4) * 2)
+    max_workers = max(1, max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(index_file, Path(p), fs_stats[p], batch_indexed_at): p
+                   for p in changed_files}
+        for future in as_completed(futures):
+            try:
+                note_data = future.result()
+                stored = db_state.get(note_data['filepath'])
+                if not full and stored and stored[2] == note_data['content_hash']:
+                    # Same bytes, new mtime: just record the new stat values
+                    # so the next run skips the file without re-reading it
+                    touch_rows.append((
+                        note_data['modified_at'],
+                        note_data['size'],
+                        note_data['indexed_at'],
+                        note_data['filepath']
+                    ))
+                    continue
+                note_rows.append((
+                    note_data['filepath'],
+                    note_data['filename'],
+                    note_data['title'],
+                    note_data['content'],
+                    note_data['tags'],
+                    note_data['created_at'],
+                    note_data['modified_at'],
+                    note_data['indexed_at'],
+                    note_data['size'],
+                    note_data['content_hash']
+                ))
+                # Precompute the summary now, while the content is already
+                # in hand, so get_note_summary never parses on demand
+                summary, key_topics = _summarize(note_data['content'])
+                summary_rows.append((
+                    note_data['filepath'], summary, key_topics,
+                    ts_to_iso(note_data['indexed_at']),
+                    hashlib.sha256(note_data['content'].encode('utf-8')).hexdigest()
+                ))
+            except Exception as e:
+                print(f"Error indexing {futures[future]}: {e}", file=sys.stderr)
+
+    indexed_count = len(note_rows)
+    removed_count = len(orphaned_files)
+
+    # On an initial load into an empty table there is nothing durable to
+    # lose, so fsyncs can be skipped entirely for the bulk transaction
+    initial_load = not db_state and len(note_rows) > 1
 
-            cursor.execute("""
-                INSERT OR REPLACE INTO notes
-                (filepath, filename, title, content, tags, created_at, modified_at, indexed_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                note_data['filepath'],
-                note_data['filename'],
-                note_data['title'],
-                note_data['content'],
-                note_data['tags'],
-                note_data['created_at'],
-                note_data['modified_at'],
-                note_data['indexed_at']
-            ))
+    try:
+        if initial_load:
+            cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("BEGIN IMMEDIATE")
+        if orphaned_files:
+            cursor.executemany("DELETE FROM notes WHERE filepath = ?",
+                               [(p,) for p in orphaned_files])
+            for filepath in orphaned_files:
+                print(f"Removed orphaned entry: {filepath}", file=sys.stderr)
+        cursor.executemany(_UPSERT_NOTE_SQL, note_rows)
+        if touch_rows:
+            cursor.executemany("""
+                UPDATE notes SET modified_at = ?, size = ?, indexed_at = ?
+                WHERE filepath = ?
+            """, touch_rows)
+        if summary_rows:
+            cursor.executemany("""
+                INSERT OR REPLACE INTO note_summaries
+                (filepath, summary, key_topics, last_updated, content_hash)
+                VALUES (?, ?, ?, ?, ?)
+            """, summary_rows)
+        cursor.execute("UPDATE kb_meta SET last_indexed = ?", (batch_indexed_at,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if initial_load:
+            cursor.execute("PRAGMA synchronous=NORMAL")
+
+    _invalidate_stats_cache(db_path)
+
+    if full:
+        # Rebuild the FTS index from the notes table and refresh planner
+        # statistics; this discards any drift the incremental triggers
+        # could have accumulated
+        cursor.execute("INSERT INTO notes_fts(notes_fts) VALUES('rebuild')")
+        cursor.execute("ANALYZE")
+
+    if indexed_count or removed_count:
+        maintenance(db_path)
 
-            cursor.execute("""
-                INSERT OR REPLACE INTO notes_fts
-                (rowid, filepath, filename, title, content, tags)
-                SELECT id, filepath, filename, title, content, tags
-                FROM notes WHERE filepath = ?
-            """, (note_data['filepath'],))
+    return indexed_count, removed_count
 
-            indexed_count += 1
-        except Exception as e:
-            print(f"Error indexing {md_file}: {e}", file=sys.stderr)
 
-    conn.commit()
-    conn.close()
+def maintenance(db_path: str):
+    """Run idle-time database maintenance after bulk work.
 
-    return indexed_count, removed_count
+    Refreshes planner statistics, hands page-cache memory back to the
+    OS (a long-running server otherwise keeps it for the process
+    lifetime), and truncates the WAL so it does not grow unbounded
+    between checkpoints.
+    """
+    conn = _get_conn(db_path)
+    conn.execute("PRAGMA optimize")
+    conn.execute("PRAGMA shrink_memory")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
 
 def search_notes_db(query: str, db_path: str, limit: int = 10) -> list:
     """Search through indexed notes."""
-    conn = sqlite3.connect(db_path)
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
+    # Materialize the top-K rowids from the FTS scan first, then pull the
+    # stored columns from the notes table for just those winners. This keeps
+    # the virtual-table scan narrow instead of reading every column through
+    # the external-content shim for rows that never make the cut.
+    # Ranking weights title hits highest, then filename and tags, with the
+    # body as baseline; filepath is UNINDEXED so its weight is zero.
+    # Column order matches the fts5 declaration.
     cursor.execute("""
-                   SELECT n.title,
-                          n.filepath,
-                          n.filename,
-                          n.tags,
-                          snippet(notes_fts, 3, '<mark>', '</mark>', '...', 30) as snippet
-                   FROM notes_fts
-                            JOIN notes n ON notes_fts.rowid = n.id
-                   WHERE notes_fts MATCH ?
-                   ORDER BY rank LIMIT ?
+                   WITH matches AS (
+                       SELECT rowid,
+                              bm25(notes_fts, 0, 5.0, 10.0, 1.0, 3.0) AS score
+                       FROM notes_fts
+                       WHERE notes_fts MATCH ?
+                       ORDER BY score LIMIT ?
+                   )
+                   SELECT n.title, n.filepath, n.filename, n.tags, m.rowid
+                   FROM matches m
+                   JOIN notes n ON n.id = m.rowid
+                   ORDER BY m.score
                    """, (query, limit))
+    winners = cursor.fetchall()
+    if not winners:
+        return []
+
+    # snippet() re-reads the document text through the external-content
+    # shim, so generate it in a second pass scoped to just the winners
+    # instead of every candidate the ranking pass visits
+    placeholders = ','.join('?' * len(winners))
+    cursor.execute(f"""
+                   SELECT rowid, snippet(notes_fts, 3, '<mark>', '</mark>', '...', 30)
+                   FROM notes_fts
+                   WHERE notes_fts MATCH ? AND rowid IN ({placeholders})
+                   """, (query, *[row[4] for row in winners]))
+    snippets = dict(cursor.fetchall())
 
-    results = cursor.fetchall()
-    conn.close()
+    return [(title, filepath, filename, tags, snippets.get(rowid, ''))
+            for title, filepath, filename, tags, rowid in winners]
 
-    return results
+
+def quick_search_db(query: str, db_path: str, limit: int = 5) -> list:
+    """Search returning only titles, paths and tags — no snippets.
+
+    Backs quick_search: snippet() re-reads every winning document through
+    the external-content shim, which dominates search_notes_db's cost,
+    and the quick path never displays snippets anyway.
+    """
+    conn = _get_conn(db_path)
+    cursor = conn.cursor()
+
+    cursor.execute("""
+                   WITH matches AS (
+                       SELECT rowid,
+                              bm25(notes_fts, 0, 5.0, 10.0, 1.0, 3.0) AS score
+                       FROM notes_fts
+                       WHERE notes_fts MATCH ?
+                       ORDER BY score LIMIT ?
+                   )
+                   SELECT n.title, n.filepath, n.filename, n.tags
+                   FROM matches m
+                   JOIN notes n ON n.id = m.rowid
+                   ORDER BY m.score
+                   """, (query, limit))
+    return cursor.fetchall()
 
 
 def get_recent_notes(db_path: str, limit: int = 20) -> list:
     """Get the most recently modified notes."""
-    conn = sqlite3.connect(db_path)
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -254,44 +788,58 @@ def get_recent_notes(db_path: str, limit: int = 20) -> list:
                    """, (limit,))
 
     results = cursor.fetchall()
-    conn.close()
 
     return results
 
 
-def get_kb_statistics(db_path: str) -> dict:
-    """Get statistics about the knowledge base."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+# Statistics cache: agents tend to poll get_kb_stats, and between writes
+# the answer cannot change. Writers invalidate explicitly; the TTL only
+# bounds staleness against writes from other processes.
+_STATS_TTL_SECONDS = 30.0
+_stats_cache = {}
 
-    cursor.execute("SELECT COUNT(*) FROM notes")
-    total_notes = cursor.fetchone()[0]
 
-    cursor.execute("SELECT MAX(indexed_at) FROM notes")
-    last_indexed = cursor.fetchone()[0]
+def _invalidate_stats_cache(db_path: str):
+    _stats_cache.pop(db_path, None)
 
-    cursor.execute("SELECT SUM(LENGTH(content)) FROM notes")
-    total_chars = cursor.fetchone()[0] or 0
 
-    conn.close()
+def get_kb_statistics(db_path: str) -> dict:
+    """Get statistics about the knowledge base."""
+    cached = _stats_cache.get(db_path)
+    now = time.monotonic()
+    if cached and now - cached[0] < _STATS_TTL_SECONDS:
+        return cached[1]
 
-    return {
+    conn = _get_conn(db_path)
+    cursor = conn.cursor()
+
+    # Everything comes from the maintained summary row, not a table scan
+    cursor.execute("SELECT total_notes, total_chars, last_indexed FROM kb_meta WHERE id = 1")
+    row = cursor.fetchone()
+    total_notes, total_chars, last_indexed = row if row else (0, 0, None)
+
+    stats = {
         'total_notes': total_notes,
-        'last_indexed': last_indexed,
+        'last_indexed': ts_to_iso(last_indexed),
         'total_chars': total_chars
     }
+    _stats_cache[db_path] = (now, stats)
+    return stats
 
 
-def upsert_note_to_db(note_data: Dict[str, Any], db_path: str):
-    """Insert or update a note in the database and FTS index."""
-    conn = sqlite3.connect(db_path)
+def upsert_notes_to_db(notes: list, db_path: str):
+    """Insert or update a batch of notes in one transaction.
+
+    The FTS index is maintained by triggers, so only the notes table is
+    written here.
+    """
+    if not notes:
+        return
+
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
-    cursor.execute("""
-        INSERT OR REPLACE INTO notes
-        (filepath, filename, title, content, tags, created_at, modified_at, indexed_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+    rows = [(
         note_data['filepath'],
         note_data['filename'],
         note_data['title'],
@@ -299,25 +847,100 @@ def upsert_note_to_db(note_data: Dict[str, Any], db_path: str):
         note_data['tags'],
         note_data['created_at'],
         note_data['modified_at'],
-        note_data['indexed_at']
-    ))
+        note_data['indexed_at'],
+        note_data.get('size'),
+        note_data.get('content_hash')
+    ) for note_data in notes]
+
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany(_UPSERT_NOTE_SQL, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    _invalidate_stats_cache(db_path)
+
+
+def upsert_note_to_db(note_data: Dict[str, Any], db_path: str):
+    """Insert or update a single note; see upsert_notes_to_db for batches."""
+    upsert_notes_to_db([note_data], db_path)
+
+
+def index_and_upsert(filepath, db_path: str, text: str = None) -> Dict[str, Any]:
+    """Index one note and write its row to the database in a single call.
+
+    With text given, the row is built from that string without touching
+    the file again (the create/update tools pass the text they just
+    wrote); otherwise the file is read from disk.
+    """
+    if text is None:
+        note_data = index_file(filepath)
+    else:
+        note_data = index_file_from_text(filepath, text)
+    upsert_note_to_db(note_data, db_path)
+    return note_data
 
-    cursor.execute("""
-        INSERT OR REPLACE INTO notes_fts
-        (rowid, filepath, filename, title, content, tags)
-        SELECT id, filepath, filename, title, content, tags
-        FROM notes WHERE filepath = ?
-    """, (note_data['filepath'],))
 
+def append_note_in_db(filepath, appended_text: str, db_path: str) -> bool:
+    """Apply an append to an indexed note without re-reading the file.
+
+    A small append to a large note used to mean reading and re-parsing
+    the entire file just to rebuild its row; this extends the stored
+    content in place, mirroring what append_to_note_file wrote (trailing
+    whitespace trimmed, blank line, new text). The column-scoped
+    triggers keep the FTS index and kb_meta totals consistent. size and
+    content_hash are cleared so the next reindex re-reads the file once
+    and restores byte-exact state.
+
+    Returns False when the note is not indexed yet; callers fall back
+    to a full index.
+    """
+    conn = _get_conn(db_path)
+    cursor = conn.cursor()
+    try:
+        modified_at = os.stat(filepath).st_mtime_ns
+    except OSError:
+        modified_at = time.time_ns()
+    cursor.execute("""
+        UPDATE notes
+        SET content = rtrim(content, ?) || ?,
+            modified_at = ?,
+            indexed_at = ?,
+            size = NULL,
+            content_hash = NULL
+        WHERE filepath = ?
+        """, (" \t\r\n", "\n\n" + appended_text, modified_at,
+              time.time_ns(), str(filepath)))
     conn.commit()
-    conn.close()
+    if cursor.rowcount == 0:
+        return False
+    _invalidate_stats_cache(db_path)
+    return True
+
+
+# Resolved KB roots, cached per kb_dir: realpath walks every path component
+# with lstat and the root never moves while the server runs
+_kb_realpath_cache = {}
 
 
-def create_note_file(kb_dir: str, title: str, content: str, tags: str = "") -> tuple[Path, str]:
+def _kb_realpath(kb_dir: str) -> str:
+    """Return the cached canonical path of the knowledge base root."""
+    real = _kb_realpath_cache.get(kb_dir)
+    if real is None:
+        real = os.path.realpath(kb_dir)
+        _kb_realpath_cache[kb_dir] = real
+    return real
+
+
+def create_note_file(kb_dir: str, title: str, content: str, tags: str = "") -> tuple[Path, str, str]:
     """Create a new markdown file with proper formatting.
 
     Returns:
-        tuple: (filepath, error_message) - error_message is empty string on success
+        tuple: (filepath, written_text, error_message) - the full text
+        written to disk (for in-memory reindexing) and an error message
+        that is empty on success
     """
     # Parse path components from title (support subdirectories)
     path_parts = title.split('/')
@@ -326,37 +949,33 @@ def create_note_file(kb_dir: str, title: str, content: str, tags: str = "") -> t
     sanitized_parts = []
     for part in path_parts:
         # Remove special characters but allow alphanumeric, spaces, hyphens, underscores
-        sanitized = re.sub(r'[^\w\s-]', '', part.lower())
-        sanitized = re.sub(r'[-\s]+', '-', sanitized).strip('-')
+        sanitized = _sanitize_slug(part)
 
         # Reject empty parts and path traversal attempts
         if not sanitized or sanitized in ('.', '..'):
-            return Path(), f"Invalid path component in title: '{part}'"
+            return Path(), "", f"Invalid path component in title: '{part}'"
 
         sanitized_parts.append(sanitized)
 
-    # Build filename from last component and directory path from the rest
+    # Build the full path with os.path: no intermediate Path allocations
+    # in a flow that bulk imports can hit thousands of times
     filename = f"{sanitized_parts[-1]}.md"
-    if len(sanitized_parts) > 1:
-        relative_dir = Path(*sanitized_parts[:-1])
-    else:
-        relative_dir = Path()
-
-    # Construct full filepath
-    filepath = Path(kb_dir) / relative_dir / filename
+    filepath_str = os.path.join(kb_dir, *sanitized_parts[:-1], filename)
 
     # SECURITY: Verify the resolved path is still within kb_dir
     try:
-        kb_dir_resolved = Path(kb_dir).resolve()
-        filepath_resolved = filepath.resolve()
-        if not str(filepath_resolved).startswith(str(kb_dir_resolved)):
-            return Path(), "Invalid path: attempt to write outside knowledge base directory"
+        kb_dir_resolved = _kb_realpath(kb_dir)
+        filepath_resolved = os.path.realpath(filepath_str)
+        if os.path.commonpath((kb_dir_resolved, filepath_resolved)) != kb_dir_resolved:
+            return Path(), "", "Invalid path: attempt to write outside knowledge base directory"
     except Exception as e:
-        return Path(), f"Path validation error: {e}"
+        return Path(), "", f"Path validation error: {e}"
+
+    filepath = Path(filepath_str)
 
     # Check if file already exists
     if filepath.exists():
-        return filepath, f"Note '{'/'.join(sanitized_parts)}' already exists. Use update_note to modify it."
+        return filepath, "", f"Note '{'/'.join(sanitized_parts)}' already exists. Use update_note to modify it."
 
     # Create frontmatter if tags provided
     frontmatter = ""
@@ -371,44 +990,66 @@ def create_note_file(kb_dir: str, title: str, content: str, tags: str = "") -> t
         filepath.parent.mkdir(parents=True, exist_ok=True)
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(full_content)
-        return filepath, ""
+        return filepath, full_content, ""
     except Exception as e:
-        return filepath, f"Error creating file: {e}"
+        return filepath, "", f"Error creating file: {e}"
 
 
-def update_note_file(filepath: Path, content: str) -> str:
+def update_note_file(filepath: Path, content: str) -> tuple[str, str]:
     """Update an existing note file, preserving frontmatter.
-    
+
     Returns:
-        Empty string on success, error message on failure
+        tuple: (written_text, error_message) - the full text written to
+        disk (for in-memory reindexing) and an error message that is
+        empty on success
     """
     if not filepath.exists():
-        return f"Note not found at {filepath}"
+        return "", f"Note not found at {filepath}"
 
     try:
-        # Read existing frontmatter if present
-        with open(filepath, 'r', encoding='utf-8') as f:
-            old_content = f.read()
-
-        frontmatter, _ = extract_frontmatter(old_content)
-
-        # Preserve frontmatter if it exists
-        if frontmatter:
-            fm_lines = ["---"]
-            for key, value in frontmatter.items():
-                fm_lines.append(f"{key}: {value}")
-            fm_lines.append("---\n")
-            full_content = "\n".join(fm_lines) + "\n" + content
-        else:
-            full_content = content
-
-        # Write updated content
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(full_content)
-
-        return ""
+        # Read only the frontmatter header (if any), not the whole note;
+        # the old body is being replaced so there is no reason to load it.
+        # Match the parser's idea of a fence: the opening line must be
+        # exactly '---' and the closing '---' must sit alone on its line,
+        # so a body that merely opens with an '----' rule is not kept.
+        header = b""
+        with open(filepath, 'rb') as f:
+            head = f.read(8192)
+            if head.startswith(b'---\n') or head.startswith(b'---\r\n'):
+                pos = 3
+                while True:
+                    fence = head.find(b'\n---', pos)
+                    newline = head.find(b'\n', fence + 1) if fence != -1 else -1
+                    if fence == -1 or newline == -1:
+                        chunk = f.read(8192)
+                        if chunk:
+                            head += chunk
+                            continue
+                        # Fence line runs to EOF without a newline
+                        if fence != -1 and head[fence + 4:].rstrip(b' \t\r') == b'':
+                            header = head[:fence + 4] + b'\n'
+                        break
+                    if head[fence + 4:newline].rstrip(b' \t\r') == b'':
+                        header = head[:newline + 1]
+                        break
+                    pos = fence + 1
+
+        # Write updated content, keeping the original frontmatter verbatim.
+        # Write to a sibling temp file and rename over the original so a
+        # crash mid-write can never leave a truncated note behind.
+        full_content = header + (b'\n' if header else b'') + content.encode('utf-8')
+        tmp_path = filepath.with_name(filepath.name + '.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(full_content)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        return full_content.decode('utf-8'), ""
     except Exception as e:
-        return f"Error updating note: {e}"
+        return "", f"Error updating note: {e}"
 
 
 def append_to_note_file(filepath: Path, content: str) -> str:
@@ -421,16 +1062,19 @@ def append_to_note_file(filepath: Path, content: str) -> str:
         return f"Note not found at {filepath}"
 
     try:
-        # Read existing content
-        with open(filepath, 'r', encoding='utf-8') as f:
-            existing_content = f.read()
-
-        # Append new content
-        updated_content = existing_content.rstrip() + "\n\n" + content
-
-        # Write back
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(updated_content)
+        # Strip trailing whitespace by truncating in place, then append.
+        # Only the tail of the file is read, so appending costs
+        # O(appended content) instead of rewriting the whole note.
+        with open(filepath, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            tail_len = min(size, 4096)
+            f.seek(size - tail_len)
+            tail = f.read(tail_len)
+            stripped_len = len(tail.rstrip())
+            if stripped_len != len(tail):
+                f.truncate(size - (len(tail) - stripped_len))
+            f.seek(0, os.SEEK_END)
+            f.write(b"\n\n" + content.encode('utf-8'))
 
         return ""
     except Exception as e:
@@ -475,21 +1119,89 @@ def create_directory(kb_dir: str, directory_path: str) -> tuple[bool, str]:
         return False, f"Error creating directory: {e}"
 
 
-def git_commit_and_push(kb_dir: str, message: str) -> tuple[bool, str]:
+# GitPython Repo handles are cached per kb_dir: opening a Repo walks the
+# directory tree and reads config on every call otherwise
+_repo_cache = {}
+
+
+def _get_repo(kb_dir: str):
+    """Return a cached GitPython Repo for kb_dir, opening it on first use."""
+    from git import Repo
+
+    repo = _repo_cache.get(kb_dir)
+    if repo is None:
+        repo = Repo(Path(kb_dir))
+        _repo_cache[kb_dir] = repo
+    return repo
+
+
+# Askpass scripts live for the process lifetime, one per token, instead of
+# being written and unlinked around every remote operation
+_askpass_scripts = {}
+
+
+def _cleanup_askpass_scripts():
+    for path in _askpass_scripts.values():
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    _askpass_scripts.clear()
+
+
+atexit.register(_cleanup_askpass_scripts)
+
+
+def _git_env(repo):
+    """Build an environment that supplies GIT_TOKEN credentials via GIT_ASKPASS.
+
+    Returns None when no token applies (no GIT_TOKEN, no origin, or a
+    non-HTTPS GitHub remote). The GIT_ASKPASS script is created once per
+    token and removed at interpreter exit.
     """
-    Commit and push changes to git repo using GitPython with secure credential handling.
+    git_token = os.environ.get("GIT_TOKEN")
+    if not git_token or 'origin' not in repo.remotes:
+        return None
+
+    # Only use token for HTTPS GitHub URLs
+    if not repo.remotes.origin.url.startswith("https://github.com/"):
+        return None
+
+    askpass_script = _askpass_scripts.get(git_token)
+    if askpass_script is None or not os.path.exists(askpass_script):
+        # Create a temporary script that returns the token
+        # This passes credentials without modifying .git/config
+        import tempfile
+        import stat
+
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.sh') as f:
+            f.write('#!/bin/sh\n')
+            f.write(f'echo "{git_token}"\n')
+            askpass_script = f.name
+
+        os.chmod(askpass_script, stat.S_IRUSR | stat.S_IXUSR)
+        _askpass_scripts[git_token] = askpass_script
+
+    custom_env = os.environ.copy()
+    custom_env['GIT_ASKPASS'] = askpass_script
+    custom_env['GIT_USERNAME'] = git_token  # For GitHub, username can be the token
+    custom_env['GIT_PASSWORD'] = git_token
+    return custom_env
+
+
+def git_commit_local(kb_dir: str, message: str) -> tuple[bool, str]:
+    """
+    Stage and commit all changes locally; fast, no network involved.
 
     Returns:
         tuple: (success: bool, message: str)
     """
-    from git import Repo, InvalidGitRepositoryError, GitCommandError
-
-    repo_path = Path(kb_dir)
+    from git import InvalidGitRepositoryError, GitCommandError
 
     try:
         # Check if it's a git repo and open it
         try:
-            repo = Repo(repo_path)
+            repo = _get_repo(kb_dir)
         except InvalidGitRepositoryError:
             return False, "Not a git repository"
 
@@ -497,9 +1209,6 @@ def git_commit_and_push(kb_dir: str, message: str) -> tuple[bool, str]:
         if repo.head.is_detached:
             return False, "Not on a branch (detached HEAD)"
 
-        # Get current branch name
-        current_branch = repo.active_branch.name
-
         # Stage all changes
         repo.git.add(A=True)
 
@@ -508,54 +1217,45 @@ def git_commit_and_push(kb_dir: str, message: str) -> tuple[bool, str]:
             return True, "No changes to commit"
 
         # Commit locally
-        commit_succeeded = False
         try:
             repo.index.commit(message)
-            commit_succeeded = True
         except GitCommandError as e:
             return False, f"Failed to create local commit: {str(e)}"
 
+        return True, f"Committed changes on {repo.active_branch.name}"
+
+    except Exception as e:
+        return False, f"Unexpected error: {str(e)}"
+
+
+def git_push_remote(kb_dir: str) -> tuple[bool, str]:
+    """
+    Rebase onto the remote branch and push local commits; network-bound.
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    from git import InvalidGitRepositoryError, GitCommandError
+
+    try:
+        try:
+            repo = _get_repo(kb_dir)
+        except InvalidGitRepositoryError:
+            return False, "Not a git repository"
+
+        current_branch = repo.active_branch.name
+
         # Prepare secure environment for git operations if GIT_TOKEN is available
-        git_token = os.environ.get("GIT_TOKEN")
-        custom_env = None
-
-        if git_token and 'origin' in repo.remotes:
-            remote_url = repo.remotes.origin.url
-
-            # Only use token for HTTPS GitHub URLs
-            if remote_url.startswith("https://github.com/"):
-                # Create custom environment with GIT_ASKPASS
-                # This passes credentials without modifying .git/config
-                import tempfile
-                import stat
-
-                # Create a temporary script that returns the token
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.sh') as f:
-                    f.write('#!/bin/sh\n')
-                    f.write(f'echo "{git_token}"\n')
-                    askpass_script = f.name
-
-                # Make script executable
-                os.chmod(askpass_script, stat.S_IRUSR | stat.S_IXUSR)
-
-                # Set up custom environment
-                custom_env = os.environ.copy()
-                custom_env['GIT_ASKPASS'] = askpass_script
-                custom_env['GIT_USERNAME'] = git_token  # For GitHub, username can be the token
-                custom_env['GIT_PASSWORD'] = git_token
+        custom_env = _git_env(repo)
 
         try:
-            # Pull with rebase (using current branch)
+            # Pull with rebase, then push (using current branch)
             origin = repo.remotes.origin
             if custom_env:
                 origin.pull(current_branch, rebase=True, env=custom_env)
-            else:
-                origin.pull(current_branch, rebase=True)
-
-            # Push (using current branch)
-            if custom_env:
                 origin.push(current_branch, env=custom_env)
             else:
+                origin.pull(current_branch, rebase=True)
                 origin.push(current_branch)
         except GitCommandError as e:
             # Commit succeeded but sync failed - likely network issue
@@ -564,13 +1264,6 @@ def git_commit_and_push(kb_dir: str, message: str) -> tuple[bool, str]:
                 return False, f"Saved locally but couldn't sync to GitHub (no internet connection). Changes will sync automatically when internet is restored."
             else:
                 return False, f"Saved locally but couldn't sync to GitHub: {str(e)}. Changes will sync on next successful operation."
-        finally:
-            # Clean up temporary askpass script
-            if custom_env and 'GIT_ASKPASS' in custom_env:
-                try:
-                    os.unlink(custom_env['GIT_ASKPASS'])
-                except Exception:
-                    pass
 
         return True, f"Successfully committed and pushed changes to {current_branch}"
 
@@ -578,6 +1271,19 @@ def git_commit_and_push(kb_dir: str, message: str) -> tuple[bool, str]:
         return False, f"Unexpected error: {str(e)}"
 
 
+def git_commit_and_push(kb_dir: str, message: str) -> tuple[bool, str]:
+    """
+    Commit and push changes to git repo using GitPython with secure credential handling.
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    success, commit_message = git_commit_local(kb_dir, message)
+    if not success or commit_message == "No changes to commit":
+        return success, commit_message
+    return git_push_remote(kb_dir)
+
+
 def git_pull_from_remote(kb_dir: str) -> tuple[bool, str]:
     """
     Pull changes from the remote git repository using GitPython with secure credential handling.
@@ -586,14 +1292,12 @@ def git_pull_from_remote(kb_dir: str) -> tuple[bool, str]:
     Returns:
         tuple: (success: bool, message: str)
     """
-    from git import Repo, InvalidGitRepositoryError, GitCommandError
-
-    repo_path = Path(kb_dir)
+    from git import InvalidGitRepositoryError, GitCommandError
 
     try:
         # Check if it's a git repo and open it
         try:
-            repo = Repo(repo_path)
+            repo = _get_repo(kb_dir)
         except InvalidGitRepositoryError:
             return False, "Not a git repository"
 
@@ -605,87 +1309,53 @@ def git_pull_from_remote(kb_dir: str) -> tuple[bool, str]:
         current_branch = repo.active_branch.name
 
         # Prepare secure environment for git operations if GIT_TOKEN is available
-        git_token = os.environ.get("GIT_TOKEN")
-        custom_env = None
-
-        if git_token and 'origin' in repo.remotes:
-            remote_url = repo.remotes.origin.url
-
-            # Only use token for HTTPS GitHub URLs
-            if remote_url.startswith("https://github.com/"):
-                # Create custom environment with GIT_ASKPASS
-                # This passes credentials without modifying .git/config
-                import tempfile
-                import stat
-
-                # Create a temporary script that returns the token
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.sh') as f:
-                    f.write('#!/bin/sh\n')
-                    f.write(f'echo "{git_token}"\n')
-                    askpass_script = f.name
-
-                # Make script executable
-                os.chmod(askpass_script, stat.S_IRUSR | stat.S_IXUSR)
-
-                # Set up custom environment
-                custom_env = os.environ.copy()
-                custom_env['GIT_ASKPASS'] = askpass_script
-                custom_env['GIT_USERNAME'] = git_token  # For GitHub, username can be the token
-                custom_env['GIT_PASSWORD'] = git_token
+        custom_env = _git_env(repo)
 
+        # Fetch from remote
+        origin = repo.remotes.origin
         try:
-            # Fetch from remote
-            origin = repo.remotes.origin
-            try:
-                if custom_env:
-                    origin.fetch(current_branch, env=custom_env)
-                else:
-                    origin.fetch(current_branch)
-            except GitCommandError as e:
-                # Fetch failed - likely network issue
-                error_str = str(e).lower()
-                if any(indicator in error_str for indicator in ['network', 'connection', 'timed out', 'could not resolve', 'failed to connect']):
-                    return False, f"Couldn't sync with GitHub (no internet connection). Your local files are safe and will sync when internet is restored."
-                else:
-                    return False, f"Couldn't sync with GitHub: {str(e)}. Your local files are safe."
-
-            # Check if we're behind remote
-            try:
-                # Count commits between HEAD and origin/current_branch
-                commits_behind = sum(1 for _ in repo.iter_commits(f'HEAD..origin/{current_branch}'))
-            except Exception:
-                commits_behind = 0
+            if custom_env:
+                origin.fetch(current_branch, env=custom_env)
+            else:
+                origin.fetch(current_branch)
+        except GitCommandError as e:
+            # Fetch failed - likely network issue
+            error_str = str(e).lower()
+            if any(indicator in error_str for indicator in ['network', 'connection', 'timed out', 'could not resolve', 'failed to connect']):
+                return False, f"Couldn't sync with GitHub (no internet connection). Your local files are safe and will sync when internet is restored."
+            else:
+                return False, f"Couldn't sync with GitHub: {str(e)}. Your local files are safe."
+
+        # Check if we're behind remote
+        try:
+            # rev-list --count lets git count commits internally instead
+            # of materializing a Commit object per revision
+            commits_behind = int(repo.git.rev_list('--count', f'HEAD..origin/{current_branch}'))
+        except Exception:
+            commits_behind = 0
 
-            if commits_behind == 0:
-                return True, "Already up to date"
+        if commits_behind == 0:
+            return True, "Already up to date"
 
-            # Pull with rebase to avoid merge commits
+        # Pull with rebase to avoid merge commits
+        try:
+            if custom_env:
+                origin.pull(current_branch, rebase=True, env=custom_env)
+            else:
+                origin.pull(current_branch, rebase=True)
+        except GitCommandError as e:
+            # If rebase fails, try to abort
             try:
-                if custom_env:
-                    origin.pull(current_branch, rebase=True, env=custom_env)
-                else:
-                    origin.pull(current_branch, rebase=True)
-            except GitCommandError as e:
-                # If rebase fails, try to abort
-                try:
-                    repo.git.rebase(abort=True)
-                except Exception:
-                    pass
-                error_str = str(e).lower()
-                if any(indicator in error_str for indicator in ['network', 'connection', 'timed out', 'could not resolve', 'failed to connect']):
-                    return False, f"Couldn't complete sync with GitHub (no internet connection). Your local files are safe."
-                else:
-                    return False, f"Git pull failed: {str(e)}"
-
-            return True, f"Pulled {commits_behind} commit(s) from {current_branch}"
-
-        finally:
-            # Clean up temporary askpass script
-            if custom_env and 'GIT_ASKPASS' in custom_env:
-                try:
-                    os.unlink(custom_env['GIT_ASKPASS'])
-                except Exception:
-                    pass
+                repo.git.rebase(abort=True)
+            except Exception:
+                pass
+            error_str = str(e).lower()
+            if any(indicator in error_str for indicator in ['network', 'connection', 'timed out', 'could not resolve', 'failed to connect']):
+                return False, f"Couldn't complete sync with GitHub (no internet connection). Your local files are safe."
+            else:
+                return False, f"Git pull failed: {str(e)}"
+
+        return True, f"Pulled {commits_behind} commit(s) from {current_branch}"
 
     except GitCommandError as e:
         error_str = str(e).lower()
@@ -698,7 +1368,7 @@ def git_pull_from_remote(kb_dir: str) -> tuple[bool, str]:
 
 def populate_tool_prompts(db_path: str):
     """Populate the tool_prompts table with initial data for small LLM guidance."""
-    conn = sqlite3.connect(db_path)
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
     tool_data = [
@@ -767,15 +1437,68 @@ def populate_tool_prompts(db_path: str):
         ),
     ]
 
-    for tool_name, instruction, examples, output_format, keywords in tool_data:
-        cursor.execute("""
-            INSERT OR REPLACE INTO tool_prompts
-            (tool_name, small_model_instruction, example_inputs, expected_output_format, keywords)
-            VALUES (?, ?, ?, ?, ?)
-        """, (tool_name, instruction, examples, output_format, keywords))
+    # Keywords are stored pre-split and lowercased as a JSON array so
+    # readers never re-run the split(',')/strip()/lower() dance per row
+    rows = [
+        (tool_name, instruction, examples, output_format,
+         json.dumps([kw.strip().lower() for kw in keywords.split(',')]))
+        for tool_name, instruction, examples, output_format, keywords in tool_data
+    ]
+
+    cursor.executemany("""
+        INSERT OR REPLACE INTO tool_prompts
+        (tool_name, small_model_instruction, example_inputs, expected_output_format, keywords)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
 
     conn.commit()
-    conn.close()
+    _tool_index_cache.pop(db_path, None)
+
+
+# Inverted keyword index for get_tool_suggestion, built lazily per db_path:
+# (tools, word_index, phrases) where word_index maps a single-word keyword to
+# tool indices and phrases holds (multi-word keyword, tool index) pairs that
+# still need a substring check.
+_tool_index_cache = {}
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def _get_tool_index(db_path: str):
+    """Load tool_prompts once and build the keyword -> tools lookup."""
+    cached = _tool_index_cache.get(db_path)
+    if cached is not None:
+        return cached
+
+    conn = _get_conn(db_path)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT COUNT(*) FROM tool_prompts")
+    if cursor.fetchone()[0] == 0:
+        populate_tool_prompts(db_path)
+
+    cursor.execute("SELECT tool_name, small_model_instruction, keywords FROM tool_prompts")
+
+    tools = []
+    word_index = {}
+    phrases = []
+    for tool_name, instruction, keywords in cursor.fetchall():
+        tool_idx = len(tools)
+        tools.append((tool_name, instruction))
+        if keywords.startswith('['):
+            keyword_list = json.loads(keywords)
+        else:
+            # Rows written before keywords became a JSON array
+            keyword_list = [kw.strip().lower() for kw in keywords.split(',')]
+        for keyword in keyword_list:
+            if ' ' in keyword:
+                phrases.append((keyword, tool_idx))
+            else:
+                word_index.setdefault(keyword, []).append(tool_idx)
+
+    cached = (tools, word_index, phrases)
+    _tool_index_cache[db_path] = cached
+    return cached
 
 
 def get_tool_suggestion(user_intent: str, db_path: str) -> dict:
@@ -788,34 +1511,25 @@ def get_tool_suggestion(user_intent: str, db_path: str) -> dict:
     Returns:
         dict with 'tool_name', 'instruction', 'confidence'
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Ensure tool_prompts table is populated
-    cursor.execute("SELECT COUNT(*) FROM tool_prompts")
-    if cursor.fetchone()[0] == 0:
-        conn.close()
-        populate_tool_prompts(db_path)
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-    # Get all tools with their keywords
-    cursor.execute("SELECT tool_name, small_model_instruction, keywords FROM tool_prompts")
-    tools = cursor.fetchall()
-    conn.close()
+    tools, word_index, phrases = _get_tool_index(db_path)
 
     intent_lower = user_intent.lower()
-    matches = []
-
-    for tool_name, instruction, keywords in tools:
-        keyword_list = [k.strip() for k in keywords.split(',')]
-        match_count = sum(1 for keyword in keyword_list if keyword in intent_lower)
-        if match_count > 0:
-            matches.append({
-                'tool_name': tool_name,
-                'instruction': instruction,
-                'match_count': match_count
-            })
+
+    # Single-word keywords hit the inverted index via the intent's word set;
+    # multi-word keywords fall back to a substring check.
+    match_counts = {}
+    for word in set(_WORD_RE.findall(intent_lower)):
+        for tool_idx in word_index.get(word, ()):
+            match_counts[tool_idx] = match_counts.get(tool_idx, 0) + 1
+    for phrase, tool_idx in phrases:
+        if phrase in intent_lower:
+            match_counts[tool_idx] = match_counts.get(tool_idx, 0) + 1
+
+    matches = [{
+        'tool_name': tools[tool_idx][0],
+        'instruction': tools[tool_idx][1],
+        'match_count': count
+    } for tool_idx, count in match_counts.items()]
 
     if not matches:
         return {
@@ -837,18 +1551,8 @@ def get_tool_suggestion(user_intent: str, db_path: str) -> dict:
     }
 
 
-def generate_note_summary(filepath: str, content: str, db_path: str) -> str:
-    """Generate and cache a summary for a note.
-
-    Args:
-        filepath: Path to the note
-        content: Note content
-        db_path: Database path
-
-    Returns:
-        Summary text (max ~100 tokens)
-    """
-    # Simple extractive summary: first paragraph + key info
+def _summarize(content: str) -> tuple[str, str]:
+    """Build the extractive summary and key topics for a note body."""
     lines = content.strip().split('\n')
 
     # Get first non-empty paragraph (up to 3 lines)
@@ -865,18 +1569,41 @@ def generate_note_summary(filepath: str, content: str, db_path: str) -> str:
     headers = [line.strip('# ').strip() for line in lines if line.startswith('#')]
     key_topics = ', '.join(headers[:5]) if headers else ''
 
-    # Cache the summary
-    conn = sqlite3.connect(db_path)
+    return summary, key_topics
+
+
+def generate_note_summary(filepath: str, content: str, db_path: str) -> str:
+    """Generate and cache a summary for a note.
+
+    Args:
+        filepath: Path to the note
+        content: Note content
+        db_path: Database path
+
+    Returns:
+        Summary text (max ~100 tokens)
+    """
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
+    # Skip the rewrite entirely when the body has not changed since the
+    # cached summary was built
+    body_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    cursor.execute("SELECT summary, content_hash FROM note_summaries WHERE filepath = ?",
+                   (filepath,))
+    cached = cursor.fetchone()
+    if cached and cached[1] == body_hash:
+        return cached[0]
+
+    summary, key_topics = _summarize(content)
+
     cursor.execute("""
         INSERT OR REPLACE INTO note_summaries
-        (filepath, summary, key_topics, last_updated)
-        VALUES (?, ?, ?, ?)
-    """, (filepath, summary, key_topics, datetime.now().isoformat()))
+        (filepath, summary, key_topics, last_updated, content_hash)
+        VALUES (?, ?, ?, ?, ?)
+    """, (filepath, summary, key_topics, datetime.now().isoformat(), body_hash))
 
     conn.commit()
-    conn.close()
 
     return summary
 
@@ -887,7 +1614,7 @@ def get_note_summary(filepath: str, db_path: str) -> dict:
     Returns:
         dict with 'summary', 'key_topics', 'filepath'
     """
-    conn = sqlite3.connect(db_path)
+    conn = _get_conn(db_path)
     cursor = conn.cursor()
 
     # Try to get cached summary
@@ -900,7 +1627,6 @@ def get_note_summary(filepath: str, db_path: str) -> dict:
     result = cursor.fetchone()
 
     if result:
-        conn.close()
         return {
             'filepath': filepath,
             'summary': result[0],
@@ -911,7 +1637,6 @@ def get_note_summary(filepath: str, db_path: str) -> dict:
     # Generate new summary if not cached
     cursor.execute("SELECT content FROM notes WHERE filepath = ?", (filepath,))
     note_result = cursor.fetchone()
-    conn.close()
 
     if not note_result:
         return {
@@ -6,6 +6,7 @@ Indexes markdown files from a directory and provides search capabilities.
 
 import os
 import sys
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import Optional
@@ -243,7 +244,8 @@ except Exception as e:
 # Ensure KB_DIR exists (needed for Railway/cloud deployments with empty volumes)
 Path(KB_DIR).mkdir(parents=True, exist_ok=True)
 
-if Path(KB_DIR).exists():
+def _startup_sync():
+    """Pull from git and index the KB without blocking server startup."""
     # Pull from remote to sync changes from other machines
     success, git_message = git_pull_from_remote(KB_DIR)
     if success:
@@ -258,6 +260,12 @@ if Path(KB_DIR).exists():
     else:
         print(f"Indexed {indexed_count} notes from {KB_DIR}", file=sys.stderr)
 
+
+if Path(KB_DIR).exists():
+    # Searches served before the first pass completes just see the previous
+    # index, so the server can start accepting requests immediately
+    threading.Thread(target=_startup_sync, name="kb-startup-sync", daemon=True).start()
+
 if __name__ == "__main__":
     # Read transport configuration from environment
     transport = os.getenv("MCP_TRANSPORT", "stdio")
@@ -275,4 +283,7 @@ if __name__ == "__main__":
             mcp.run(transport="stdio")
     except KeyboardInterrupt:
         print("\nShutting down gracefully...", file=sys.stderr)
+        # Ship any commit+push batches the background worker had not
+        # gotten to yet before the process goes away
+        tools.flush_git_queue()
         sys.exit(0)
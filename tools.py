@@ -4,28 +4,188 @@ MCP tools for the Knowledge Base server.
 Defines all available tools/functions that can be called via MCP.
 """
 
+import asyncio
+import io
+import os
+import re
+import sys
+from functools import lru_cache
 from pathlib import Path
 from fastmcp import Context
 
 from database import (
     search_notes_db,
+    quick_search_db,
     get_recent_notes,
     get_kb_statistics,
     index_directory,
     create_note_file,
     update_note_file,
     append_to_note_file,
-    index_file,
-    upsert_note_to_db,
+    index_and_upsert,
+    append_note_in_db,
     git_commit_and_push,
     git_pull_from_remote,
     create_directory,
     get_tool_suggestion,
     get_note_summary,
-    populate_tool_prompts
+    populate_tool_prompts,
+    ts_to_iso
 )
 
 
+# One background worker serializes git commit+push so note edits return as
+# soon as the file write and index upsert land. Failures are logged to
+# stderr: by the time the push runs, the request that caused it is gone.
+_git_queue = None
+_git_worker = None
+
+# The KB root is fixed by KB_DIR, so after the first edit in a directory
+# this avoids the O(depth) stat() walk on every update/append. Misses are
+# cached too; maxsize bounds growth if notes land in many directories.
+# Plain os.path string walking: no Path objects built per level, and the
+# str key hashes cheaper in the cache than a PurePath.
+@lru_cache(maxsize=512)
+def _find_git_root(start: str):
+    """Return the nearest ancestor of start containing .git, or None."""
+    current = start
+    while True:
+        # exists(), not isdir(): .git is a plain file in worktrees
+        if os.path.exists(os.path.join(current, ".git")):
+            return current
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+
+
+def _enqueue_git_sync(repo_dir: str, message: str) -> None:
+    """Queue a commit+push for the background git worker, starting it lazily."""
+    global _git_queue, _git_worker
+    if _git_queue is None:
+        _git_queue = asyncio.Queue()
+    if _git_worker is None or _git_worker.done():
+        _git_worker = asyncio.get_running_loop().create_task(_run_git_queue())
+    _git_queue.put_nowait((repo_dir, message))
+
+
+async def _run_git_queue() -> None:
+    while True:
+        repo_dir, message = await _git_queue.get()
+        # Coalesce edits that queued up while the previous push ran into a
+        # single commit+push instead of one fsync-heavy round trip per note
+        messages = [message]
+        while True:
+            try:
+                next_dir, next_message = _git_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if next_dir != repo_dir:
+                # Different repo: flush the current batch first, then this
+                # item comes back around on the next loop iteration
+                _git_queue.put_nowait((next_dir, next_message))
+                break
+            messages.append(next_message)
+        if len(messages) > 1:
+            message = f"Sync {len(messages)} note edits\n\n" + "\n".join(messages)
+        try:
+            success, git_message = await asyncio.to_thread(git_commit_and_push, repo_dir, message)
+            if not success:
+                print(f"Background git sync failed: {git_message}", file=sys.stderr)
+        except Exception as e:
+            print(f"Background git sync error: {e}", file=sys.stderr)
+        finally:
+            for _ in messages:
+                _git_queue.task_done()
+
+
+def flush_git_queue() -> None:
+    """Run any git syncs still queued at shutdown, synchronously.
+
+    By the time the server's shutdown path runs, the event loop and the
+    background worker are gone, so waiting on the queue would hang; drain
+    it directly instead, coalescing per repo like the worker does.
+    """
+    if _git_queue is None:
+        return
+    pending = {}
+    while True:
+        try:
+            repo_dir, message = _git_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        pending.setdefault(repo_dir, []).append(message)
+    for repo_dir, messages in pending.items():
+        if len(messages) > 1:
+            message = f"Sync {len(messages)} note edits\n\n" + "\n".join(messages)
+        else:
+            message = messages[0]
+        try:
+            success, git_message = git_commit_and_push(repo_dir, message)
+            if not success:
+                print(f"Shutdown git sync failed: {git_message}", file=sys.stderr)
+        except Exception as e:
+            print(f"Shutdown git sync error: {e}", file=sys.stderr)
+
+
+# Chatty agents repeat the same query within seconds; serve those from an
+# in-process cache. The database (or WAL) file mtime rides along in the key,
+# so any write naturally invalidates every cached result.
+def _db_mtime(db_path: str) -> int:
+    """Newest mtime of the database or its WAL file, for cache keys."""
+    try:
+        mtime = os.stat(db_path).st_mtime_ns
+    except OSError:
+        return -1
+    try:
+        return max(mtime, os.stat(db_path + "-wal").st_mtime_ns)
+    except OSError:
+        return mtime
+
+
+@lru_cache(maxsize=256)
+def _cached_search(query: str, db_path: str, limit: int, db_mtime: int):
+    return search_notes_db(query, db_path, limit)
+
+
+@lru_cache(maxsize=256)
+def _cached_quick_search(query: str, db_path: str, limit: int, db_mtime: int):
+    return quick_search_db(query, db_path, limit)
+
+
+# Parallel sub-agents fire identical queries within the same millisecond;
+# the lru_cache only helps after the first one finishes, so concurrent
+# duplicates ride on the first call's future instead of each taking a
+# worker thread and a DB round trip.
+_inflight = {}
+
+
+async def _search_shared(query: str, db_path: str, limit: int, quick: bool = False):
+    search = _cached_quick_search if quick else _cached_search
+    key = (query, db_path, limit, quick)
+    fut = _inflight.get(key)
+    if fut is not None:
+        return await fut
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        results = await asyncio.to_thread(search, query, db_path, limit, _db_mtime(db_path))
+    except BaseException as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved in case nobody else awaited it
+        raise
+    else:
+        fut.set_result(results)
+        return results
+    finally:
+        _inflight.pop(key, None)
+
+
+@lru_cache(maxsize=32)
+def _cached_recent(db_path: str, limit: int, db_mtime: int):
+    return get_recent_notes(db_path, limit)
+
+
 async def search_notes(query: str, db_path: str, limit: int = 10) -> str:
     """
     Search through your knowledge base notes.
@@ -37,30 +197,39 @@ async def search_notes(query: str, db_path: str, limit: int = 10) -> str:
         :param query:
         :param db_path:
     """
-    results = search_notes_db(query, db_path, limit)
+    # Off-thread so a cold FTS query cannot stall other tool calls;
+    # concurrent duplicates share one query
+    results = await _search_shared(query, db_path, limit)
 
     if not results:
         return f"No results found for '{query}'"
 
-    output = [f"Found {len(results)} results for '{query}':\n"]
+    # Write into one growing buffer rather than a list of fragments
+    # that join has to walk again
+    output = io.StringIO()
+    output.write(f"Found {len(results)} results for '{query}':\n\n")
 
     for i, (title, filepath, filename, tags, snippet) in enumerate(results, 1):
-        output.append(f"{i}. **{title}**")
-        output.append(f"   File: {filepath}")
+        output.write(f"{i}. **{title}**\n")
+        output.write(f"   File: {filepath}\n")
         if tags:
-            output.append(f"   Tags: {tags}")
-        output.append(f"   ...{snippet}...")
-        output.append("")
+            output.write(f"   Tags: {tags}\n")
+        output.write(f"   ...{snippet}...\n\n")
+
+    return output.getvalue().rstrip("\n") + "\n"
 
-    return "\n".join(output)
+
+def _read_file(filepath: str) -> str:
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return f.read()
 
 
 async def read_note(filepath: str) -> str:
     """Read the complete contents of a note."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return f"# {Path(filepath).name}\n\n{content}"
+        # Read on a worker thread so a slow disk does not stall the loop
+        content = await asyncio.to_thread(_read_file, filepath)
+        return f"# {os.path.basename(filepath)}\n\n{content}"
     except FileNotFoundError:
         return f"Note not found: {filepath}"
     except Exception as e:
@@ -82,8 +251,8 @@ async def sync_from_git(kb_dir: str, db_path: str, ctx: Context = None) -> str:
     Returns:
         Status message with git pull result and reindex statistics
     """
-    # Pull from GitHub
-    success, message = git_pull_from_remote(kb_dir)
+    # Pull from GitHub (off the event loop: network + subprocess work)
+    success, message = await asyncio.to_thread(git_pull_from_remote, kb_dir)
     if not success:
         if ctx:
             await ctx.warning(f"Git sync failed: {message}")
@@ -93,7 +262,7 @@ async def sync_from_git(kb_dir: str, db_path: str, ctx: Context = None) -> str:
         await ctx.info(f"Git: {message}")
 
     # Reindex database with new files
-    indexed, removed = index_directory(kb_dir, db_path)
+    indexed, removed = await asyncio.to_thread(index_directory, kb_dir, db_path)
 
     if ctx:
         await ctx.info(f"Reindexed {indexed} notes, removed {removed} orphaned entries")
@@ -105,14 +274,16 @@ async def reindex_kb(ctx: Context, kb_dir: str, db_path: str) -> str:
     """Reindex all Markdown files in the knowledge base directory."""
     await ctx.info(f"Starting reindex of {kb_dir}...")
 
-    # Pull from remote first to sync changes from other machines
-    success, git_message = git_pull_from_remote(kb_dir)
+    # Pull from remote first to sync changes from other machines; both the
+    # pull and the filesystem walk run in a worker thread so other tool
+    # calls keep being served meanwhile
+    success, git_message = await asyncio.to_thread(git_pull_from_remote, kb_dir)
     if success:
         await ctx.info(f"Git sync: {git_message}")
     else:
         await ctx.warning(f"Git sync: {git_message}")
 
-    indexed_count, removed_count = index_directory(kb_dir, db_path)
+    indexed_count, removed_count = await asyncio.to_thread(index_directory, kb_dir, db_path)
 
     if removed_count > 0:
         message = f"Successfully indexed {indexed_count} notes and removed {removed_count} orphaned entries from {kb_dir}"
@@ -132,33 +303,42 @@ async def reindex_kb(ctx: Context, kb_dir: str, db_path: str) -> str:
 
 async def list_recent_notes(db_path: str, limit: int = 20) -> str:
     """List the most recently modified notes."""
-    results = get_recent_notes(db_path, limit)
+    results = await asyncio.to_thread(_cached_recent, db_path, limit, _db_mtime(db_path))
 
     if not results:
         return "No notes found. Run reindex_kb first."
 
-    output = [f"Recent notes (last {len(results)}):\n"]
+    output = io.StringIO()
+    output.write(f"Recent notes (last {len(results)}):\n\n")
 
     for i, (title, filepath, filename, modified_at, tags) in enumerate(results, 1):
-        output.append(f"{i}. **{title}**")
-        output.append(f"   File: {filepath}")
-        output.append(f"   Modified: {modified_at}")
+        output.write(f"{i}. **{title}**\n")
+        output.write(f"   File: {filepath}\n")
+        output.write(f"   Modified: {ts_to_iso(modified_at)}\n")
         if tags:
-            output.append(f"   Tags: {tags}")
-        output.append("")
+            output.write(f"   Tags: {tags}\n")
+        output.write("\n")
 
-    return "\n".join(output)
+    return output.getvalue().rstrip("\n") + "\n"
+
+
+# The stats response shape never changes; build the template once
+_STATS_TEMPLATE = """Knowledge Base Statistics:
+- Total notes: {total_notes}
+- Total content: {total_chars:,} characters
+- Directory: {kb_dir}
+- Last indexed: {last_indexed}"""
 
 
 async def get_kb_stats(kb_dir: str, db_path: str) -> str:
     """Get statistics about your knowledge base."""
-    stats = get_kb_statistics(db_path)
+    stats = await asyncio.to_thread(get_kb_statistics, db_path)
 
-    return f"""Knowledge Base Statistics:
-- Total notes: {stats['total_notes']}
-- Total content: {stats['total_chars']:,} characters
-- Directory: {kb_dir}
-- Last indexed: {stats['last_indexed'] or 'Never'}"""
+    return _STATS_TEMPLATE.format_map({
+        **stats,
+        'kb_dir': kb_dir,
+        'last_indexed': stats['last_indexed'] or 'Never',
+    })
 
 
 async def create_note(title: str, content: str, kb_dir: str, db_path: str, tags: str = "", ctx: Context = None) -> str:
@@ -175,29 +355,24 @@ async def create_note(title: str, content: str, kb_dir: str, db_path: str, tags:
     Returns:
         Confirmation message with filepath
     """
-    filepath, error = create_note_file(kb_dir, title, content, tags)
-    
+    filepath, written, error = create_note_file(kb_dir, title, content, tags)
+
     if error:
         return f"Error: {error}"
-    
-    # Index the new note
+
+    # Index the new note from the content just written, without re-reading it
     try:
-        note_data = index_file(filepath)
-        upsert_note_to_db(note_data, db_path)
+        await asyncio.to_thread(index_and_upsert, filepath, db_path, written)
 
         if ctx:
             await ctx.info(f"Created note: {filepath}")
 
-        # Git commit and push
-        success, git_message = git_commit_and_push(kb_dir, f"Created note: {title}")
-        if success:
-            if ctx:
-                await ctx.info(f"Git: {git_message}")
-            git_status = f"\n\n📦 Git: {git_message}"
-        else:
-            if ctx:
-                await ctx.warning(f"Git: {git_message}")
-            git_status = f"\n\n⚠️ Git: {git_message}"
+        # Git commit and push run in the background; the tool returns as
+        # soon as the note is written and indexed
+        _enqueue_git_sync(kb_dir, f"Created note: {title}")
+        if ctx:
+            await ctx.info("Git: commit and push queued")
+        git_status = "\n\n📦 Git: sync queued"
 
         return f"Successfully created note '{title}' at:\n{filepath}{git_status}"
     except Exception as e:
@@ -218,38 +393,26 @@ async def update_note(filepath: str, content: str, db_path: str, ctx: Context =
     """
     note_path = Path(filepath)
     
-    error = update_note_file(note_path, content)
+    written, error = update_note_file(note_path, content)
     if error:
         return f"Error: {error}"
-    
-    # Re-index the note
+
+    # Re-index the note from the text just written, without re-reading it
     try:
-        note_data = index_file(note_path)
-        upsert_note_to_db(note_data, db_path)
+        await asyncio.to_thread(index_and_upsert, note_path, db_path, written)
 
         if ctx:
             await ctx.info(f"Updated note: {filepath}")
 
-        # Find git root by walking up from note_path.parent
-        git_root = None
-        current = note_path.parent
-        while current != current.parent:
-            if (current / ".git").exists():
-                git_root = current
-                break
-            current = current.parent
+        # Git root for this directory is cached after the first lookup
+        git_root = _find_git_root(str(note_path.parent))
 
-        # Git commit and push
+        # Git commit and push run in the background
         if git_root:
-            success, git_message = git_commit_and_push(str(git_root), f"Updated note: {note_path.name}")
-            if success:
-                if ctx:
-                    await ctx.info(f"Git: {git_message}")
-                git_status = f"\n\n📦 Git: {git_message}"
-            else:
-                if ctx:
-                    await ctx.warning(f"Git: {git_message}")
-                git_status = f"\n\n⚠️ Git: {git_message}"
+            _enqueue_git_sync(git_root, f"Updated note: {note_path.name}")
+            if ctx:
+                await ctx.info("Git: commit and push queued")
+            git_status = "\n\n📦 Git: sync queued"
         else:
             git_status = "\n\n⚠️ Git: Not a git repository"
             if ctx:
@@ -278,34 +441,25 @@ async def append_to_note(filepath: str, content: str, db_path: str, ctx: Context
     if error:
         return f"Error: {error}"
     
-    # Re-index the note
+    # Extend the stored row in place; only fall back to a full re-read
+    # when the note was never indexed
     try:
-        note_data = index_file(note_path)
-        upsert_note_to_db(note_data, db_path)
+        updated = await asyncio.to_thread(append_note_in_db, note_path, content, db_path)
+        if not updated:
+            await asyncio.to_thread(index_and_upsert, note_path, db_path)
 
         if ctx:
             await ctx.info(f"Appended to note: {filepath}")
 
-        # Find git root by walking up from note_path.parent
-        git_root = None
-        current = note_path.parent
-        while current != current.parent:
-            if (current / ".git").exists():
-                git_root = current
-                break
-            current = current.parent
+        # Git root for this directory is cached after the first lookup
+        git_root = _find_git_root(str(note_path.parent))
 
-        # Git commit and push
+        # Git commit and push run in the background
         if git_root:
-            success, git_message = git_commit_and_push(str(git_root), f"Appended to note: {note_path.name}")
-            if success:
-                if ctx:
-                    await ctx.info(f"Git: {git_message}")
-                git_status = f"\n\n📦 Git: {git_message}"
-            else:
-                if ctx:
-                    await ctx.warning(f"Git: {git_message}")
-                git_status = f"\n\n⚠️ Git: {git_message}"
+            _enqueue_git_sync(git_root, f"Appended to note: {note_path.name}")
+            if ctx:
+                await ctx.info("Git: commit and push queued")
+            git_status = "\n\n📦 Git: sync queued"
         else:
             git_status = "\n\n⚠️ Git: Not a git repository"
             if ctx:
@@ -338,6 +492,25 @@ async def create_kb_directory(directory_path: str, kb_dir: str, ctx: Context = N
     return message
 
 
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# The recommendation shape never changes; build the template once
+_SUGGEST_TEMPLATE = """Tool Recommendation (confidence: {confidence}):
+
+**Use tool:** {tool_name}
+
+**How to use it:**
+{instruction}
+
+**Your request:** "{user_request}"
+"""
+
+
+@lru_cache(maxsize=1024)
+def _cached_suggestion(normalized_request: str, db_path: str):
+    return get_tool_suggestion(normalized_request, db_path)
+
+
 async def what_should_i_do_tool(user_request: str, db_path: str) -> str:
     """
     SMALL MODEL HELPER: Not sure which tool to use? Describe what you want to do.
@@ -358,19 +531,12 @@ async def what_should_i_do_tool(user_request: str, db_path: str) -> str:
 
     Returns exact tool name and parameters to use.
     """
-    suggestion = get_tool_suggestion(user_request, db_path)
-
-    output = f"""Tool Recommendation (confidence: {suggestion['confidence']}):
+    # Intents repeat heavily ("find my notes", "add a note", ...); cache on
+    # a whitespace/case-normalized form so trivial variations hit too
+    normalized = _WHITESPACE_RE.sub(" ", user_request.strip().lower())
+    suggestion = await asyncio.to_thread(_cached_suggestion, normalized, db_path)
 
-**Use tool:** {suggestion['tool_name']}
-
-**How to use it:**
-{suggestion['instruction']}
-
-**Your request:** "{user_request}"
-"""
-
-    return output
+    return _SUGGEST_TEMPLATE.format_map({**suggestion, 'user_request': user_request})
 
 
 async def quick_search_tool(keywords: str, db_path: str) -> str:
@@ -384,20 +550,21 @@ async def quick_search_tool(keywords: str, db_path: str) -> str:
     Returns:
         Compact list of top 5 matching notes with titles and filepaths only.
     """
-    results = search_notes_db(keywords, db_path, limit=5)
+    results = await _search_shared(keywords, db_path, 5, quick=True)
 
     if not results:
         return f"No notes found matching: {keywords}"
 
-    output = [f"Found {len(results)} notes:\n"]
+    output = io.StringIO()
+    output.write(f"Found {len(results)} notes:\n\n")
 
-    for i, (title, filepath, filename, tags, _) in enumerate(results, 1):
-        output.append(f"{i}. {title}")
-        output.append(f"   Path: {filepath}")
+    for i, (title, filepath, filename, tags) in enumerate(results, 1):
+        output.write(f"{i}. {title}\n")
+        output.write(f"   Path: {filepath}\n")
         if tags:
-            output.append(f"   Tags: {tags}")
+            output.write(f"   Tags: {tags}\n")
 
-    return "\n".join(output)
+    return output.getvalue().rstrip("\n")
 
 
 async def get_summary_tool(filepath: str, db_path: str) -> str:
@@ -411,12 +578,12 @@ async def get_summary_tool(filepath: str, db_path: str) -> str:
     Returns:
         Brief summary (max 100 tokens) with key topics
     """
-    summary_data = get_note_summary(filepath, db_path)
+    summary_data = await asyncio.to_thread(get_note_summary, filepath, db_path)
 
     if summary_data['summary'] == 'Note not found':
         return f"Error: Note not found at {filepath}"
 
-    output = f"""Summary of: {Path(filepath).name}
+    output = f"""Summary of: {os.path.basename(filepath)}
 
 {summary_data['summary']}"""
 
@@ -432,7 +599,7 @@ async def get_summary_tool(filepath: str, db_path: str) -> str:
 async def initialize_tool_prompts(db_path: str) -> str:
     """Initialize the tool_prompts table with guidance for small LLMs."""
     try:
-        populate_tool_prompts(db_path)
+        await asyncio.to_thread(populate_tool_prompts, db_path)
         return "Tool prompts initialized successfully"
     except Exception as e:
         return f"Error initializing tool prompts: {e}"